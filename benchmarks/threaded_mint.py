@@ -0,0 +1,65 @@
+"""
+Multi-threaded minting throughput
+=================================
+Mint noids from a shared :py:class:`noid.Minter` with an increasing number of threads and report throughput.
+
+On a free-threaded (no-GIL) CPython build (e.g. ``python3.13t``) throughput should grow with the number of threads
+because the minter keeps its random state per thread and reserves sequential indices in blocks. On a regular build
+the GIL serialises the threads so throughput stays roughly flat.
+
+Usage (with the package installed e.g. ``pip install -e .``):
+python benchmarks/threaded_mint.py [-t TEMPLATE] [-n NOIDS_PER_THREAD] [-T MAX_THREADS] [--sequential]
+"""
+import argparse
+import sys
+import threading
+import time
+
+from noid import Minter
+
+
+def run(minter, threads, count, sequential):
+    """Mint 'count' noids on each of 'threads' threads; return the elapsed time in seconds"""
+    barrier = threading.Barrier(threads + 1)
+    mint = minter.next if sequential else minter.mint
+
+    def work():
+        barrier.wait()
+        for _ in range(count):
+            mint()
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="multi-threaded minting throughput")
+    parser.add_argument('-t', '--template', default='zeeeeddddk', help="the template to mint from")
+    parser.add_argument('-n', '--count', type=int, default=100_000, help="noids minted per thread")
+    parser.add_argument('-T', '--max-threads', type=int, default=8, help="largest number of threads to try")
+    parser.add_argument('--sequential', action='store_true', default=False, help="mint sequentially")
+    args = parser.parse_args()
+    gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print(f"python {sys.version.split()[0]}; GIL {'enabled' if gil_enabled else 'disabled'}")
+    print(f"{'threads':>8} {'noids/s':>14} {'speedup':>8}")
+    baseline = None
+    threads = 1
+    while threads <= args.max_threads:
+        minter = Minter(args.template)
+        elapsed = run(minter, threads, args.count, args.sequential)
+        rate = threads * args.count / elapsed
+        if baseline is None:
+            baseline = rate
+        print(f"{threads:>8} {rate:>14,.0f} {rate / baseline:>8.2f}")
+        threads *= 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,3 @@
-from noid.pynoid import calculate_check_digit, mint, validate, generate_noid
+from noid.pynoid import calculate_check_digit, mint, validate, generate_noid, decode_noid, Minter
 
-__all__ = [mint, validate, generate_noid, calculate_check_digit]
+__all__ = [mint, validate, generate_noid, decode_noid, calculate_check_digit, Minter]
@@ -0,0 +1,375 @@
+"""
+A memory-mapped occupancy bitmap for a namespace
+================================================
+One bit per index of a template's namespace records whether the index has been minted so that no noid is ever
+issued twice and the namespace can be filled completely. A template with ``utils.get_noid_range(mask)`` of 10^10
+needs a file of about 1.2 GB; it is created sparse so unused regions take no disk space.
+
+The file is a 24-byte header (the magic ``NOIDBMP3``, then the namespace size and the number of marked indices as
+little-endian 64-bit integers), the number of marked indices in each chunk of ``CHUNK * 8`` indices (little-endian
+64-bit integers) and then the bits: index ``i`` is bit ``i % 8`` of byte ``i // 8``, so each little-endian 64-bit
+word holds 64 consecutive indices. The chunk counts let :py:meth:`NamespaceBitmap.claim_random` find the r-th free
+index without scanning the whole namespace and let :py:meth:`NamespaceBitmap.claim` skip chunks which are full.
+
+The bitmap may be shared by threads and by processes: every change is made while holding an exclusive
+:py:func:`fcntl.flock` on the file (where available) and all state lives in the shared memory map. Every newly
+marked index is written to disk before it is returned so that no index handed out is lost if the machine crashes.
+"""
+import contextlib
+import mmap
+import os
+import random
+import struct
+import threading
+
+from noid.exceptions import NamespaceExhaustedError, NamespaceOverflowError, NoidError
+
+try:
+    import fcntl
+except ImportError:  # Windows: the bitmap is only safe to share between threads
+    fcntl = None
+
+MAGIC = b'NOIDBMP3'
+HEADER = struct.Struct('<8sQQ')
+COUNT = struct.Struct('<Q')
+USED_OFFSET = 16
+WORD = 8  # bytes
+FULL_WORD = (1 << 64) - 1
+CHUNK = 1 << 20  # bytes scanned at a time and counted in the file
+# the ranges (in indices) narrowed down in turn to select a free index within a chunk
+SELECT_STEPS = (1 << 15, 1 << 9, 1 << 6)
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def _popcount(value):
+        return bin(value).count('1')
+
+
+def _chunks(size: int) -> int:
+    """The number of chunks in a namespace of 'size' indices"""
+    return -(-size // (CHUNK * 8))
+
+
+class NamespaceBitmap:
+    """Track which indices of a namespace have been minted
+
+    Example:
+    with NamespaceBitmap('zeeek.bitmap', utils.get_noid_range('zeeek')) as bitmap:
+        bitmap.mark(37)         # True (newly marked)
+        37 in bitmap            # True
+        bitmap.claim()          # 0; the lowest free index, now marked
+        bitmap.claim(37)        # 38; the first free index at or after 37
+        bitmap.claim_random()   # a free index chosen uniformly at random
+        bitmap.used             # 3
+    """
+
+    def __init__(self, path, size: int = None):
+        """
+
+        :param path: path to the bitmap file; created if it does not exist
+        :param int size: the number of indices in the namespace; required to create the file and checked otherwise
+        :raises NoidError: if the file is not a bitmap or its size differs from 'size'
+        """
+        self.path = os.fspath(path)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        self._file = os.fdopen(fd, 'rb+')
+        self._lock = threading.Lock()
+        try:
+            with self._locked():
+                self.size = self._initialise(size)
+                self._map = mmap.mmap(self._file.fileno(), 0)
+            # the offset of the bits
+            self._bits = HEADER.size + COUNT.size * _chunks(self.size)
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _initialise(self, size: int) -> int:
+        """Write the header of a new (empty) file or check the header of an existing one; return the size"""
+        header = self._file.read(HEADER.size)
+        if not header:
+            if size is None:
+                raise NoidError(f"the size of a new bitmap '{self.path}' is required")
+            if size < 1:
+                raise ValueError(f"size must be positive: {size}")
+            self._file.write(HEADER.pack(MAGIC, size, 0))
+            # round up to whole words; truncate() leaves the file sparse
+            self._file.truncate(HEADER.size + COUNT.size * _chunks(size) + -(-size // 64) * WORD)
+            self._file.flush()
+            return size
+        magic, _size, _ = HEADER.unpack(header.ljust(HEADER.size, b'\0'))
+        if magic != MAGIC:
+            raise NoidError(f"'{self.path}' is not a namespace bitmap")
+        if size is not None and size != _size:
+            raise NoidError(f"bitmap '{self.path}' tracks {_size} indices, not {size}")
+        return _size
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the bitmap exclusively against other threads and processes"""
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _add_used(self, index: int):
+        """Count 'index' as newly marked in the header and its chunk and write the changes to disk
+
+        The bit of 'index' must already be set and the bitmap must be locked.
+        """
+        COUNT.pack_into(self._map, USED_OFFSET, self.used + 1)
+        chunk = index // (CHUNK * 8)
+        COUNT.pack_into(self._map, HEADER.size + COUNT.size * chunk, self._chunk_used(chunk) + 1)
+        # the page holding the bit, then the header and counts up to this chunk
+        page = (self._bits + (index >> 3)) // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY
+        self._map.flush(page, min(mmap.ALLOCATIONGRANULARITY, len(self._map) - page))
+        self._map.flush(0, HEADER.size + COUNT.size * (chunk + 1))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path!r}, size={self.size})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, index: int) -> bool:
+        return self.test(index)
+
+    def _check(self, index: int):
+        if not 0 <= index < self.size:
+            raise NamespaceOverflowError(f"index {index} is outside the namespace (size = {self.size})")
+
+    @property
+    def used(self) -> int:
+        """The number of marked indices"""
+        return COUNT.unpack_from(self._map, USED_OFFSET)[0]
+
+    @property
+    def free(self) -> int:
+        """The number of unmarked indices"""
+        return self.size - self.used
+
+    @property
+    def occupancy(self) -> float:
+        """The fraction of the namespace that is marked"""
+        return self.used / self.size
+
+    def test(self, index: int) -> bool:
+        """Whether 'index' is marked
+
+        :param int index: an index in the namespace
+        :return bool: True if marked
+        """
+        self._check(index)
+        return bool(self._map[self._bits + (index >> 3)] & (1 << (index & 7)))
+
+    def mark(self, index: int) -> bool:
+        """Mark 'index' as used
+
+        :param int index: an index in the namespace
+        :return bool: True if the index was free (i.e. is newly marked)
+        """
+        self._check(index)
+        offset = self._bits + (index >> 3)
+        bit = 1 << (index & 7)
+        with self._locked():
+            byte = self._map[offset]
+            if byte & bit:
+                return False
+            self._map[offset] = byte | bit
+            self._add_used(index)
+            return True
+
+    def count(self, start: int = 0, stop: int = None) -> int:
+        """Count the marked indices in [start, stop) by popcount
+
+        :param int start: the first index
+        :param int stop: one past the last index (default: the size of the namespace)
+        :return int: the number of marked indices
+        """
+        stop = self.size if stop is None else min(stop, self.size)
+        if start >= stop:
+            return 0
+        first, last = start >> 3, (stop - 1) >> 3
+        total = 0
+        for offset in range(first, last + 1, CHUNK):
+            chunk = self._map[self._bits + offset:self._bits + min(offset + CHUNK, last + 1)]
+            value = int.from_bytes(chunk, 'little')
+            if offset == first:
+                value >>= start & 7
+                value <<= start & 7
+            if offset + CHUNK > last:
+                value &= (1 << ((last - offset) * 8 + ((stop - 1) & 7) + 1)) - 1
+            total += _popcount(value)
+        return total
+
+    def recount(self) -> int:
+        """Recount the marked indices and store the results in the file
+
+        The stored counts may be one short for each process that crashed while marking an index or, after a power
+        loss, one too high for each index that was being marked.
+
+        :return int: the number of marked indices
+        """
+        with self._locked():
+            return self._recount()
+
+    def _recount(self) -> int:
+        used = 0
+        for chunk in range(_chunks(self.size)):
+            count = self.count(chunk * CHUNK * 8, (chunk + 1) * CHUNK * 8)
+            COUNT.pack_into(self._map, HEADER.size + COUNT.size * chunk, count)
+            used += count
+        COUNT.pack_into(self._map, USED_OFFSET, used)
+        self._map.flush(0, self._bits)
+        return used
+
+    def select_free(self, rank: int) -> int:
+        """Find the unmarked index with the given rank i.e. the (rank + 1)-th unmarked index
+
+        The chunk is found from the chunk counts, then narrowed by popcount to a block, a word and a bit.
+
+        :param int rank: the rank, from 0 to :py:attr:`free` - 1
+        :return int: the index or -1 if there is none
+        """
+        chunks = _chunks(self.size)
+        counts = struct.unpack_from(f'<{chunks}Q', self._map, HEADER.size)
+        for chunk, used in enumerate(counts):
+            start = chunk * CHUNK * 8
+            stop = min(start + CHUNK * 8, self.size)
+            if rank < stop - start - used:
+                break
+            rank -= stop - start - used
+        else:
+            return -1
+        for step in SELECT_STEPS:
+            for begin in range(start, stop, step):
+                end = min(begin + step, stop)
+                free = end - begin - self.count(begin, end)
+                if rank < free:
+                    start, stop = begin, end
+                    break
+                rank -= free
+            else:
+                return -1
+        # clear the lowest 'rank' unmarked bits of the word
+        unmarked = ~self._word(start >> 3) & ((1 << (stop - start)) - 1)
+        if rank >= _popcount(unmarked):
+            return -1
+        for _ in range(rank):
+            unmarked &= unmarked - 1
+        return start + (unmarked & -unmarked).bit_length() - 1
+
+    def _word(self, offset: int) -> int:
+        """The 64-bit word at byte 'offset' of the bits"""
+        return int.from_bytes(self._map[self._bits + offset:self._bits + offset + WORD], 'little')
+
+    def _chunk_used(self, chunk: int) -> int:
+        """The stored number of marked indices in 'chunk'"""
+        return COUNT.unpack_from(self._map, HEADER.size + COUNT.size * chunk)[0]
+
+    def _find_free(self, start: int, stop: int) -> int:
+        """The first unmarked index in [start, stop) or -1, skipping chunks whose counts show they are full
+
+        A count is only too high after a power loss (see :py:meth:`recount`); that may hide a free index but never
+        returns a marked one.
+        """
+        while start < stop:
+            chunk = start // (CHUNK * 8)
+            end = min((chunk + 1) * CHUNK * 8, self.size)
+            if self._chunk_used(chunk) < end - chunk * CHUNK * 8:
+                index = self._scan_free(start, min(end, stop))
+                if index >= 0:
+                    return index
+            start = end
+        return -1
+
+    def _scan_free(self, start: int, stop: int) -> int:
+        """The first unmarked index in [start, stop) or -1, scanning the bits"""
+        offset = (start >> 6) * WORD
+        end = -(-stop // 64) * WORD
+        # the word containing 'start' with the bits below 'start' treated as marked
+        word = self._word(offset) | ((1 << (start & 63)) - 1)
+        if word == FULL_WORD:
+            offset += WORD
+            # skip runs of fully marked bytes a chunk at a time
+            while offset < end:
+                chunk = self._map[self._bits + offset:self._bits + min(offset + CHUNK, end)]
+                skip = len(chunk) - len(chunk.lstrip(b'\xff'))
+                if skip < len(chunk):
+                    offset += skip - skip % WORD
+                    break
+                offset += len(chunk)
+            else:
+                return -1
+            word = self._word(offset)
+        # isolate the lowest unmarked bit
+        index = offset * 8 + (~word & (word + 1)).bit_length() - 1
+        return index if index < stop else -1
+
+    def next_free(self, start: int = 0, wrap: bool = True) -> int:
+        """Find the first unmarked index at or after 'start', searching a word at a time
+
+        :param int start: the index at which to begin searching
+        :param bool wrap: continue searching from index 0 if nothing is free after 'start'
+        :return int: the index or -1 if there is none
+        """
+        self._check(start)
+        index = self._find_free(start, self.size)
+        if index < 0 and wrap and start > 0:
+            index = self._find_free(0, start)
+        return index
+
+    def claim(self, start: int = None) -> int:
+        """Mark and return the first unmarked index at or after 'start' (wrapping around)
+
+        :param int start: the index at which to begin searching (default: the lowest free index)
+        :return int: the claimed index
+        :raises NamespaceExhaustedError: if every index is marked
+        """
+        with self._locked():
+            index = self.next_free(0 if start is None else start)
+            if index < 0:
+                raise NamespaceExhaustedError(f"namespace of bitmap '{self.path}' is full ({self.size} indices)")
+            self._map[self._bits + (index >> 3)] |= 1 << (index & 7)
+            self._add_used(index)
+            return index
+
+    def claim_random(self, rng=random) -> int:
+        """Mark and return an unmarked index chosen uniformly at random
+
+        :param rng: the source of randomness; any object with a ``randrange`` method (default: the random module)
+        :return int: the claimed index
+        :raises NamespaceExhaustedError: if every index is marked
+        """
+        with self._locked():
+            index = self.select_free(rng.randrange(self.free)) if self.free else -1
+            if index < 0 and self._recount() < self.size:
+                # the stored counts were stale (see recount())
+                index = self.select_free(rng.randrange(self.free))
+            if index < 0:
+                raise NamespaceExhaustedError(f"namespace of bitmap '{self.path}' is full ({self.size} indices)")
+            self._map[self._bits + (index >> 3)] |= 1 << (index & 7)
+            self._add_used(index)
+            return index
+
+    def flush(self):
+        """Write changes to disk"""
+        self._map.flush()
+
+    def close(self):
+        """Flush and close the bitmap"""
+        if not self._file.closed:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
@@ -56,6 +56,27 @@ parser.add_argument(
     default=-1,
     help="a number for which to generate a valid noid [default: random positive integer]"
 )
+parser.add_argument(
+    '-B', '--bitmap',
+    default=None,
+    help="path to a bitmap of minted indices from which to draw unused noids [default: no bitmap]"
+)
+parser.add_argument(
+    '-J', '--journal',
+    default=None,
+    help="path to a journal in which to record minted noids [default: no journal]"
+)
+parser.add_argument(
+    '-R', '--requester',
+    default='',
+    help="the requester recorded in the journal [default: the current user]"
+)
+parser.add_argument(
+    '--repair-journal',
+    action='store_true',
+    default=False,
+    help="drop corrupt records from the journal instead of refusing to use it [default: False]"
+)
 parser.add_argument(
     '-v', '--verbose',
     action='store_true',
@@ -63,6 +84,75 @@ parser.add_argument(
     help="turn on verbose text [default: False]"
 )
 
+parser.set_defaults(command=None)
+
+# 'noid transcode ...' uses its own parser
+transcode_parser = argparse.ArgumentParser(
+    prog='noid transcode',
+    description='transcode noids from one template to another; prints tab-separated old and new noids'
+)
+transcode_parser.set_defaults(command='transcode')
+transcode_parser.add_argument(
+    '--from',
+    dest='from_template',
+    required=True,
+    help="the template the noids were minted with"
+)
+transcode_parser.add_argument(
+    '--to',
+    dest='to_template',
+    required=True,
+    help="the template to transcode to"
+)
+transcode_parser.add_argument(
+    '--from-scheme',
+    default=DEFAULT_SCHEME,
+    help=f"the scheme of the noids [default: '{DEFAULT_SCHEME}']"
+)
+transcode_parser.add_argument(
+    '--from-naa',
+    default=DEFAULT_NAA,
+    help=f"the name assigning authority (NAA) number of the noids [default: {DEFAULT_NAA}]"
+)
+transcode_parser.add_argument(
+    '--to-scheme',
+    default=None,
+    help="the scheme to transcode to [default: same as --from-scheme]"
+)
+transcode_parser.add_argument(
+    '--to-naa',
+    default=None,
+    help="the name assigning authority (NAA) number to transcode to [default: same as --from-naa]"
+)
+transcode_parser.add_argument(
+    '-i', '--input',
+    default='-',
+    help="a file with one noid per line; '-' for stdin [default: stdin]"
+)
+transcode_parser.add_argument(
+    '-o', '--output',
+    default='-',
+    help="the file to write old and new noids to; '-' for stdout [default: stdout]"
+)
+transcode_parser.add_argument(
+    '-C', '--chunk-size',
+    type=int,
+    default=10000,
+    help="the number of noids transcoded together [default: 10000]"
+)
+transcode_parser.add_argument(
+    '-j', '--jobs',
+    type=int,
+    default=1,
+    help="the number of processes to use [default: 1]"
+)
+transcode_parser.add_argument(
+    '-v', '--verbose',
+    action='store_true',
+    default=False,
+    help="turn on verbose text [default: False]"
+)
+
 
 class _ConfigParser(ConfigParser):
     """String-printable version"""
@@ -86,8 +176,19 @@ def read_configs(args):
     return configs
 
 
+def parse_transcode_args():
+    """Parse CLI args for 'noid transcode'"""
+    args = transcode_parser.parse_args(sys.argv[2:])
+    if args.chunk_size < 1 or args.jobs < 1:
+        print("error: chunk size and jobs must be positive", file=sys.stderr)
+        return None
+    return args
+
+
 def parse_args():
     """Parse CLI args"""
+    if sys.argv[1:2] == ['transcode']:
+        return parse_transcode_args()
     args = parser.parse_args()
     # attach configs to the args namespace
     if args.config_file:
@@ -103,6 +204,10 @@ def parse_args():
                 else:
                     print(f"warning: configs missing option '{o}'; using default value ({getattr(args, o)})",
                           file=sys.stderr)
+            # journaling and bitmaps are optional so there is no warning when these are missing
+            for o in ['bitmap', 'journal', 'requester']:
+                if o in configs['noid'] and not getattr(args, o):
+                    setattr(args, o, configs.get('noid', o))
         else:
             print(f"warning: config file '{args.config_file}' lacks 'noid' section; ignoring config file",
                   file=sys.stderr)
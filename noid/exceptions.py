@@ -0,0 +1,26 @@
+class NoidError(Exception):
+    """Base class for all errors raised while minting noids"""
+
+
+class InvalidTemplateError(NoidError, ValueError):
+    """The template (or its mask) cannot be used to mint noids"""
+
+
+class InvalidNoidError(NoidError, ValueError):
+    """The noid could not have been minted from the template"""
+
+
+class NamespaceOverflowError(NoidError, ValueError):
+    """The requested index lies outside the namespace of the template"""
+
+
+class NamespaceExhaustedError(NamespaceOverflowError):
+    """Every index in the namespace has been minted"""
+
+
+class JournalError(NoidError):
+    """The journal is corrupt or could not be written"""
+
+
+class DuplicateNoidError(NoidError, ValueError):
+    """The noid has already been minted"""
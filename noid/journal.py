@@ -0,0 +1,290 @@
+"""
+An append-only journal of minted noids
+======================================
+Every noid handed out can be recorded together with a timestamp and the requester. Records are buffered and
+group-committed: a background thread writes all records that arrived while the previous write was in progress (or
+within ``interval`` seconds, or up to ``batch_size`` records) and makes them durable with a single ``fsync``.
+:py:meth:`Journal.record` blocks until its record is durable so a noid is never returned before it is journaled.
+
+Each record is one line: an 8-hex-digit CRC32 checksum, a space, then a JSON object with the keys ``noid``, ``time``
+and ``requester``. On opening, the journal is verified: torn or corrupt records after the last valid record (from a
+crash mid-write) are truncated and a corrupt record followed by valid records raises a :py:class:`JournalError`
+unless the journal is opened with ``repair=True`` (see :py:func:`repair`).
+
+Only one :py:class:`Journal` (in one process) should append to a file at a time.
+"""
+import collections
+import json
+import os
+import threading
+import time
+import zlib
+
+from noid.exceptions import JournalError
+
+JournalRecord = collections.namedtuple('JournalRecord', ['noid', 'timestamp', 'requester'])
+JournalReport = collections.namedtuple('JournalReport', ['records', 'corrupt', 'torn'])
+
+
+def _encode(noid: str, timestamp: float, requester: str) -> bytes:
+    """Serialise a record to a checksummed line"""
+    payload = json.dumps({'noid': noid, 'time': timestamp, 'requester': requester}, separators=(',', ':')).encode()
+    return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+
+def _decode(line: bytes):
+    """Deserialise a checksummed line; return None if the line is corrupt"""
+    checksum, _, payload = line.rstrip(b'\n').partition(b' ')
+    try:
+        if int(checksum, 16) != zlib.crc32(payload):
+            return None
+        record = json.loads(payload)
+        return JournalRecord(record['noid'], record['time'], record['requester'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _fsync_directory(path):
+    """Make the directory entry of 'path' durable (where the platform allows directories to be opened)"""
+    if getattr(os, 'O_DIRECTORY', None) is None:
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def replay(path):
+    """Iterate over the valid records of the journal at 'path'
+
+    :param path: path to the journal
+    :return: an iterator of :py:class:`JournalRecord` objects
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            record = _decode(line) if line.endswith(b'\n') else None
+            if record is not None:
+                yield record
+
+
+def verify(path) -> JournalReport:
+    """Check every record of the journal at 'path'
+
+    :param path: path to the journal
+    :return JournalReport: the number of valid records, the (1-based) line numbers of corrupt records and whether
+        the final record is torn (incomplete)
+    """
+    return _verify(path)[0]
+
+
+def _verify(path) -> tuple:
+    """Check every record; also return the line number of the last valid record and the offset of its end"""
+    records = 0
+    corrupt = list()
+    torn = False
+    last = end = offset = 0
+    with open(path, 'rb') as f:
+        for line_number, line in enumerate(f, start=1):
+            offset += len(line)
+            if not line.endswith(b'\n'):
+                torn = True
+            elif _decode(line) is None:
+                corrupt.append(line_number)
+            else:
+                records += 1
+                last, end = line_number, offset
+    return JournalReport(records, corrupt, torn), last, end
+
+
+def repair(path) -> JournalReport:
+    """Rewrite the journal at 'path' without its corrupt and torn records
+
+    Valid records after a corrupt one are kept: they may be noids that were never handed out (from a batch that was
+    not yet durable when the machine crashed) but a journal may list too many noids, never too few.
+
+    :param path: path to the journal
+    :return JournalReport: the report of the journal before it was repaired
+    """
+    report = verify(path)
+    if report.corrupt or report.torn:
+        repaired = f"{path}.repair"
+        with open(path, 'rb') as f, open(repaired, 'wb') as g:
+            for line in f:
+                if line.endswith(b'\n') and _decode(line) is not None:
+                    g.write(line)
+            g.flush()
+            os.fsync(g.fileno())
+        os.replace(repaired, path)
+        _fsync_directory(path)
+    return report
+
+
+def unjournaled(path, noids) -> list:
+    """Find the noids which do not appear in the journal at 'path'
+
+    Use this to reconcile the journal against another record of issued noids (e.g. a database) after a crash.
+
+    :param path: path to the journal
+    :param noids: an iterable of noids believed to have been minted
+    :return list: the noids (in their original order) missing from the journal
+    """
+    noids = list(noids)
+    missing = set(noids)
+    for record in replay(path):
+        missing.discard(record.noid)
+        if not missing:
+            break
+    return [noid for noid in noids if noid in missing]
+
+
+class Journal:
+    """Group-committed append-only journal of minted noids
+
+    Example:
+    with Journal('minted.journal') as journal:
+        journal.record(mint(), requester='alice')
+    """
+
+    def __init__(self, path, interval: float = 0.0, batch_size: int = 4096, repair: bool = False):
+        """
+
+        :param path: path to the journal; created if it does not exist
+        :param float interval: the longest time (in seconds) to wait for more records before committing a batch
+            (default: 0, commit whatever arrived during the previous commit)
+        :param int batch_size: the largest number of records committed together
+        :param bool repair: drop corrupt records followed by valid ones instead of raising (see :py:func:`repair`)
+        :raises JournalError: if the existing journal has corrupt records followed by valid ones and 'repair' is False
+        """
+        self.path = os.fspath(path)
+        self.interval = interval
+        self.batch_size = batch_size
+        created = not os.path.exists(self.path)
+        self.report = self._recover(repair)
+        self._file = open(self.path, 'ab')
+        if created:
+            # otherwise the file itself (and so every record) may vanish after a power loss
+            try:
+                _fsync_directory(self.path)
+            except OSError:
+                self._file.close()
+                raise
+        self._condition = threading.Condition()
+        self._pending = list()
+        self._recorded = 0
+        self._durable = 0
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._commit, name=f"journal:{self.path}", daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path!r})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _recover(self, rewrite: bool) -> JournalReport:
+        """Verify an existing journal and truncate torn or corrupt records after the last valid record
+
+        A crash while a batch is written may leave any mix of torn, corrupt and valid records at the end of the
+        journal. Only those after the last valid record can be dropped safely without rewriting the journal.
+        """
+        if not os.path.exists(self.path):
+            return JournalReport(0, list(), False)
+        report, last, end = _verify(self.path)
+        if report.corrupt and report.corrupt[0] < last:
+            if not rewrite:
+                raise JournalError(f"journal '{self.path}' has corrupt records on lines {report.corrupt} followed "
+                                   f"by valid records; open it with repair=True to drop them")
+            repair(self.path)
+        elif report.corrupt or report.torn:
+            with open(self.path, 'rb+') as f:
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+            _fsync_directory(self.path)
+        return report
+
+    def _commit(self):
+        """Background thread: write and fsync pending records in batches"""
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                deadline = time.monotonic() + self.interval
+                while len(self._pending) < self.batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                committed = self._durable + len(batch)
+            try:
+                self._file.write(b''.join(batch))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                with self._condition:
+                    self._error = e
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._durable = committed
+                self._condition.notify_all()
+
+    def _wait(self, sequence: int):
+        """Block until record number 'sequence' is durable; the condition must be held"""
+        while self._durable < sequence and self._error is None:
+            self._condition.wait()
+        if self._durable < sequence:
+            raise JournalError(f"failed to write journal '{self.path}': {self._error}")
+
+    def record(self, noid: str, requester: str = '', wait: bool = True) -> int:
+        """Append a record for 'noid'
+
+        :param str noid: the minted noid
+        :param str requester: who requested the noid
+        :param bool wait: block until the record is durable (default: True); otherwise call :py:meth:`sync` later
+        :return int: the sequence number of the record in this session
+        :raises JournalError: if the journal is closed or could not be written
+        """
+        line = _encode(noid, time.time(), requester)
+        with self._condition:
+            if self._closed:
+                raise JournalError(f"journal '{self.path}' is closed")
+            if self._error is not None:
+                raise JournalError(f"failed to write journal '{self.path}': {self._error}")
+            self._pending.append(line)
+            self._recorded += 1
+            sequence = self._recorded
+            self._condition.notify_all()
+            if wait:
+                self._wait(sequence)
+        return sequence
+
+    def sync(self):
+        """Block until every record appended so far is durable
+
+        :raises JournalError: if the journal could not be written
+        """
+        with self._condition:
+            self._wait(self._recorded)
+
+    def close(self):
+        """Commit outstanding records and close the journal"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._file.close()
+        if self._error is not None:
+            raise JournalError(f"failed to write journal '{self.path}': {self._error}")
@@ -1,20 +1,38 @@
+import contextlib
+import getpass
 import os
 import sys
-from random import randint
+import threading
+from configparser import ExtendedInterpolation
+from random import Random, randint
 
 from noid import utils, cli
+from noid.bitmap import NamespaceBitmap
+from noid.exceptions import (DuplicateNoidError, InvalidNoidError, InvalidTemplateError, JournalError,
+                             NamespaceOverflowError, NoidError)
+from noid.journal import Journal
 
 # make exit codes cross-platform
 SUCCESS_EXIT_CODE = getattr(os, 'EX_OK', 0)
 USAGE_EXIT_CODE = getattr(os, 'EX_USAGE', 64)
+DATAERR_EXIT_CODE = getattr(os, 'EX_DATAERR', 65)
+IOERR_EXIT_CODE = getattr(os, 'EX_IOERR', 74)
 
-def mint(template: str = 'zek', n: int = -1, scheme: str = '', naa: str = '') -> str:
+# the value of each extended digit
+_XDIGIT_INDEX = {char: index for index, char in enumerate(utils.XDIGIT)}
+
+
+def mint(template: str = 'zek', n: int = -1, scheme: str = '', naa: str = '', journal: Journal = None,
+         requester: str = '', bitmap: NamespaceBitmap = None) -> str:
     """ Mint identifiers according to template with a prefix of scheme + naa.
 
     :param str template: a string consisting of GENTYPE + (DIGTYPE)+ [+ CHECKDIGIT]
     :param int n: a number to convert to a noid; default is -1 meaning create from random number
     :param str scheme: a scheme e.g. 'ark:/', 'doi:', 'http://', 'https://' etc.
     :param str naa: name assigning authority (number); can also be a string
+    :param Journal journal: a journal in which to record the noid (default: None, no journal)
+    :param str requester: the requester recorded in the journal
+    :param NamespaceBitmap bitmap: a bitmap of the indices already minted from this template (default: None)
     :return noid: a valid noid with/out check digit or the empty string (failure)
     :rtype str
 
@@ -31,11 +49,14 @@ def mint(template: str = 'zek', n: int = -1, scheme: str = '', naa: str = '') ->
 
     The result is appended to the scheme and naa as follows: scheme + naa + '/' + [id].
 
-    There is no checking to ensure ids are not reminted. Instead, minting can be controlled by supplying a (int)
-    value for 'n'. It is possible to implement ordered or random minting from available ids by manipulating this
-    number from another program. If no 'n' is given, minting is random from within the namespace. An indicator is
-    added between '/' and [id] to mark these ids as for short term testing only. An override may be added later to
-    accommodate applications which don't mind getting used ids.
+    Unless a 'bitmap' is given (see below), there is no checking to ensure ids are not reminted. Instead, minting can
+    be controlled by supplying a (int) value for 'n'. It is possible to implement ordered or random minting from
+    available ids by manipulating this number from another program. If no 'n' is given, minting is random from within
+    the namespace. An indicator is added between '/' and [id] to mark these ids as for short term testing only. An
+    override may be added later to accommodate applications which don't mind getting used ids.
+
+    If a 'bitmap' is given, random minting draws only from the indices not yet marked in it (so no id is reminted
+    and the namespace can be filled completely) and an explicit 'n' which has already been marked is refused.
 
     A note about 'r', 's', and 'z': 'z' indicates that a namespace should expand on its first element to accommodate
     any 'n' value (eg. 'de' becomes 'dde' then 'ddde' as numbers get larger). That expansion can be handled by this
@@ -48,13 +69,51 @@ def mint(template: str = 'zek', n: int = -1, scheme: str = '', naa: str = '') ->
         return ''
     if naa:
         naa += '/'
+    if bitmap is not None:
+        n = _claim(bitmap, mask, n)
+        if n is None:
+            return ''
     _noid = generate_noid(mask, n)
     noid = f"{scheme}{naa}{prefix}{_noid}"
     if mask[-1] in utils.CHECKDIG:
         noid = f"{noid}{calculate_check_digit(_noid)}"
+    if journal is not None and _noid:
+        journal.record(noid, requester)
     return noid
 
 
+def _open_bitmap(path, template: str) -> NamespaceBitmap:
+    """Open (or create) the bitmap for the namespace of 'template'
+
+    :param path: path to the bitmap file
+    :param str template: the template
+    :return NamespaceBitmap: the bitmap
+    :raises InvalidTemplateError: if the template is invalid; the file is left untouched
+    """
+    _, mask = utils.remove_prefix(template)
+    if not mask or not utils.validate_mask(mask):
+        raise InvalidTemplateError(f"invalid template '{template}'")
+    return NamespaceBitmap(path, utils.get_noid_range(mask))
+
+
+def _claim(bitmap: NamespaceBitmap, mask: str, n: int):
+    """Mark 'n' (or a random free index, if 'n' is negative) in the bitmap; print errors and return None on failure"""
+    if bitmap.size != utils.get_noid_range(mask):
+        print(f"error: bitmap tracks {bitmap.size} indices but mask '{mask}' has {utils.get_noid_range(mask)}",
+              file=sys.stderr)
+        return None
+    try:
+        if n < 0:
+            return bitmap.claim_random()
+        if not bitmap.mark(n):
+            print(f"error: a noid for (counter = {n}) has already been minted.", file=sys.stderr)
+            return None
+    except NoidError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return None
+    return n
+
+
 def generate_noid(mask: str, n: int) -> str:
     """The actual noid generation
 
@@ -66,43 +125,325 @@ def generate_noid(mask: str, n: int) -> str:
         if mask[0] in utils.GENTYPES:
             mask = mask[1:]
         n = randint(0, utils.get_noid_range(mask) - 1)
-    length = n
-    noid = ''
-    # construct the noid starting from the right
-    # convert the numerical value 'n' to the digits specified in the mask
-    for char in mask[::-1]:
+    try:
+        return _encode(*_compile(mask), n)
+    except NoidError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return ''
+
+
+def _compile(mask: str) -> tuple:
+    """Reduce a mask to the radices used to encode a number
+
+    :param str mask: the mask string
+    :return tuple: the radix of each digit (left to right), the radix used to expand a 'z' mask (``None`` if the
+        mask does not expand; 0 if the expansion character is corrupt) and the expansion character
+    """
+    radices = list()
+    for char in mask:
         if char == 'e':
-            div = len(utils.XDIGIT)
+            radices.append(len(utils.XDIGIT))
         elif char == 'd':
-            div = len(utils.DIGIT)
-        else:
-            continue
-        value = n % div
-        n = n // div
-        noid += (utils.XDIGIT[value])
-    # if we have anytheng left over we continue using the leftmost mask character
-    # this should not happen with 'z'
+            radices.append(len(utils.DIGIT))
+    expand = None
+    # 'z' masks keep using the leftmost mask character as numbers get larger
     if mask[0] == 'z':
-        char = mask[1]
-        while n > 0:
-            if char == 'e':
-                div = len(utils.XDIGIT)
-            elif char == 'd':
-                div = len(utils.DIGIT)
-            else:
-                print(f"error: template mask is corrupt; cannot process character: {char}", file=sys.stderr)
-                return ''
-            value = n % div
-            n = n // div
-            noid += (utils.XDIGIT[value])
+        char = mask[1:2]
+        if char == 'e':
+            expand = len(utils.XDIGIT)
+        elif char == 'd':
+            expand = len(utils.DIGIT)
+        else:
+            expand = 0
+    return radices, expand, mask[1:2]
+
 
+def _encode(radices: list, expand: int, char: str, n: int) -> str:
+    """Convert the number 'n' into noid digits
+
+    :param list radices: the radix of each digit from left to right
+    :param int expand: the radix for leftmost expansion (see :py:func:`_compile`)
+    :param str char: the mask character used for expansion; only used in error messages
+    :param int n: the number to convert
+    :return str: the noid (without prefix or check digit)
+    :raises InvalidTemplateError: if expansion is needed but the mask cannot expand
+    :raises NamespaceOverflowError: if 'n' does not fit in the namespace
+    """
+    counter = n
+    digits = list()
+    # construct the noid starting from the right
+    for div in reversed(radices):
+        n, value = divmod(n, div)
+        digits.append(utils.XDIGIT[value])
+    # if we have anything left over we continue using the leftmost mask character
+    if expand is not None:
+        while n > 0:
+            if not expand:
+                raise InvalidTemplateError(f"template mask is corrupt; cannot process character: {char}")
+            n, value = divmod(n, expand)
+            digits.append(utils.XDIGIT[value])
     # if there is still something left over, we've exceeded our namespace.
-    # checks elsewhere should prevent this case from ever evaluating true.
     if n > 0:
-        print(f"error: cannot mint a noid for (counter = {length}) within this namespace.", file=sys.stderr)
-        return ''
+        raise NamespaceOverflowError(f"cannot mint a noid for (counter = {counter}) within this namespace.")
     # since we generated the noid from right to left we reverse it
-    return noid[::-1]
+    return ''.join(reversed(digits))
+
+
+def _decode(radices: list, expand: int, body: str) -> int:
+    """Convert noid digits back into the number they encode (the inverse of :py:func:`_encode`)
+
+    :param list radices: the radix of each digit from left to right
+    :param int expand: the radix for leftmost expansion (see :py:func:`_compile`)
+    :param str body: the noid digits (without prefix or check digit)
+    :return int: the number
+    :raises InvalidNoidError: if the digits do not fit the mask
+    """
+    extra = len(body) - len(radices)
+    if extra < 0 or (extra > 0 and not expand):
+        raise InvalidNoidError(f"'{body}' has {len(body)} digits but the mask has {len(radices)}")
+    if extra > 0 and body[0] == utils.XDIGIT[0]:
+        # expansion never produces leading zeros
+        raise InvalidNoidError(f"'{body}' has a leading zero in its expanded digits")
+    n = 0
+    for position, char in enumerate(body):
+        radix = expand if position < extra else radices[position - extra]
+        value = _XDIGIT_INDEX.get(char, radix)
+        if value >= radix:
+            raise InvalidNoidError(f"invalid character '{char}' at position {position} of '{body}'")
+        n = n * radix + value
+    return n
+
+
+def decode_noid(mask: str, noid: str) -> int:
+    """The number from which a noid was generated (the inverse of :py:func:`generate_noid`)
+
+    :param str mask: the mask string
+    :param str noid: the noid without scheme, naa, prefix or check digit
+    :return int: the number
+    :raises InvalidNoidError: if the noid could not have been generated from the mask
+    """
+    radices, expand, _ = _compile(mask)
+    return _decode(radices, expand, noid)
+
+
+class Minter:
+    """A reusable minter bound to a single template, scheme and naa
+
+    Unlike :py:func:`mint`, a minter reports failures by raising a :py:class:`noid.exceptions.NoidError` and is safe
+    to share between threads without relying on the GIL:
+
+    * random minting draws from a per-thread :py:class:`random.Random` so threads never contend for RNG state; pass
+      ``seed`` to make minting reproducible from a single thread (with several threads, the n-th thread to mint uses
+      ``f"{seed}:{n}"`` but which thread is n-th depends on how the threads are scheduled);
+    * sequential minting (:py:meth:`next`) hands each thread a block of ``block_size`` indices reserved under a
+      lock, so the lock is taken once per block rather than once per noid. Indices are unique across threads but
+      are only ordered within a thread; indices left in a thread's block when it stops minting are never issued.
+
+    Example:
+    minter = Minter('zeek', scheme='ark:/', naa='12345')
+    minter.mint()      # ark:/12345/Tfo
+    minter.mint(37)    # ark:/12345/0Cg
+    minter.next()      # ark:/12345/000
+
+    If a :py:class:`noid.journal.Journal` is given, every noid returned by :py:meth:`mint` and :py:meth:`next` is
+    recorded (with its requester) and durable before it is returned.
+
+    If a :py:class:`noid.bitmap.NamespaceBitmap` is given, minting draws only from unmarked indices: random minting
+    chooses uniformly among the free indices, :py:meth:`next` takes the lowest free index and an
+    explicit 'n' is refused if already marked. The bitmap covers the unexpanded mask, even for 'z' masks.
+    """
+
+    def __init__(self, template: str = 'zek', scheme: str = '', naa: str = '', seed=None, start: int = 0,
+                 block_size: int = 1024, journal: Journal = None, requester: str = '',
+                 bitmap: NamespaceBitmap = None):
+        """
+
+        :param str template: a string consisting of GENTYPE + (DIGTYPE)+ [+ CHECKDIGIT]
+        :param str scheme: a scheme e.g. 'ark:/', 'doi:', 'http://', 'https://' etc.
+        :param str naa: name assigning authority (number); can also be a string
+        :param seed: seed for the per-thread random number generators; reproducible only from a single thread
+            (default: None, seed from the OS)
+        :param int start: the first index handed out by :py:meth:`next`
+        :param int block_size: the number of sequential indices reserved by a thread at a time
+        :param Journal journal: a journal in which to record minted noids (default: None, no journal)
+        :param str requester: the default requester recorded in the journal
+        :param NamespaceBitmap bitmap: a bitmap of the indices already minted (default: None, no tracking)
+        :raises InvalidTemplateError: if the template's mask is invalid
+        :raises NoidError: if the bitmap's size differs from the template's namespace
+        """
+        prefix, mask = utils.remove_prefix(template)
+        if not mask or not utils.validate_mask(mask):
+            raise InvalidTemplateError(f"invalid template '{template}'")
+        if block_size < 1:
+            raise ValueError(f"block_size must be positive: {block_size}")
+        self.template = template
+        self.scheme = scheme
+        self.naa = naa
+        self.seed = seed
+        self.block_size = block_size
+        self.journal = journal
+        self.requester = requester
+        self._prefix = f"{scheme}{naa}/{prefix}" if naa else f"{scheme}{prefix}"
+        self._mask = mask
+        self._compiled = _compile(mask)
+        self._check_digit = mask[-1] in utils.CHECKDIG
+        # 'z' masks expand without limit; random minting is confined to the unexpanded mask
+        self._expands = mask[0] == 'z'
+        self.size = utils.get_noid_range(mask)
+        if bitmap is not None and bitmap.size != self.size:
+            raise NoidError(f"bitmap tracks {bitmap.size} indices but template '{template}' has {self.size}")
+        self.bitmap = bitmap
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._next_block = start
+        self._threads = 0
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(template={self.template!r}, scheme={self.scheme!r}, naa={self.naa!r})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @classmethod
+    def from_config(cls, config_file, **kwargs):
+        """Create a minter from the 'noid' section of a config file
+
+        The section may set 'template', 'scheme', 'naa', 'bitmap' (a path; see :py:class:`noid.bitmap.NamespaceBitmap`)
+        and, to turn on journaling, 'journal' (a path) and 'requester'. Keyword arguments are passed on to the
+        constructor and override the config file.
+
+        :param config_file: path to a config file with a noid section
+        :return Minter: the minter; close it to close its journal and bitmap
+        :raises NoidError: if the config file lacks a 'noid' section
+        """
+        configs = cli._ConfigParser(interpolation=ExtendedInterpolation())
+        configs.read(config_file)
+        if 'noid' not in configs.sections():
+            raise NoidError(f"config file '{config_file}' lacks 'noid' section")
+        options = dict(configs['noid'])
+        for option in ['template', 'scheme', 'naa', 'requester']:
+            if option in options:
+                kwargs.setdefault(option, options[option])
+        # close whatever was opened if anything later fails
+        with contextlib.ExitStack() as stack:
+            if 'journal' in options and 'journal' not in kwargs:
+                kwargs['journal'] = stack.enter_context(Journal(options['journal']))
+            if 'bitmap' in options and 'bitmap' not in kwargs:
+                kwargs['bitmap'] = stack.enter_context(_open_bitmap(options['bitmap'], kwargs.get('template', 'zek')))
+            minter = cls(**kwargs)
+            stack.pop_all()
+        return minter
+
+    def close(self):
+        """Close the journal and bitmap, if any"""
+        if self.journal is not None:
+            self.journal.close()
+        if self.bitmap is not None:
+            self.bitmap.close()
+
+    def _issue(self, noid: str, requester: str) -> str:
+        """Journal a noid before handing it out"""
+        if self.journal is not None:
+            self.journal.record(noid, self.requester if requester is None else requester)
+        return noid
+
+    def _random(self) -> Random:
+        """The calling thread's random number generator"""
+        try:
+            return self._local.random
+        except AttributeError:
+            if self.seed is None:
+                rng = Random()
+            else:
+                with self._lock:
+                    thread_number = self._threads
+                    self._threads += 1
+                rng = Random(f"{self.seed}:{thread_number}")
+            self._local.random = rng
+            return rng
+
+    def _next_index(self) -> int:
+        """The next sequential index from the calling thread's block"""
+        local = self._local
+        index = getattr(local, 'index', 0)
+        if index >= getattr(local, 'end', 0):
+            with self._lock:
+                index = self._next_block
+                self._next_block += self.block_size
+            end = index + self.block_size
+            if not self._expands:
+                if index >= self.size:
+                    raise NamespaceOverflowError(f"namespace of template '{self.template}' is exhausted")
+                end = min(end, self.size)
+            local.end = end
+        local.index = index + 1
+        return index
+
+    def noid(self, n: int) -> str:
+        """Format the index 'n' as a full noid (scheme, naa, prefix and check digit)
+
+        :param int n: a non-negative number to convert to a noid
+        :return str: the noid
+        :raises NamespaceOverflowError: if 'n' does not fit in the template
+        """
+        if n < 0:
+            raise NamespaceOverflowError(f"cannot mint a noid for a negative index ({n})")
+        _noid = _encode(*self._compiled, n)
+        if self._check_digit:
+            return f"{self._prefix}{_noid}{calculate_check_digit(_noid)}"
+        return f"{self._prefix}{_noid}"
+
+    def index(self, noid: str) -> int:
+        """The index from which 'noid' was formatted (the inverse of :py:meth:`noid`)
+
+        :param str noid: a full noid (scheme, naa, prefix and check digit)
+        :return int: the index
+        :raises InvalidNoidError: if the noid could not have been minted by this minter
+        """
+        if not noid.startswith(self._prefix):
+            raise InvalidNoidError(f"'{noid}' does not start with '{self._prefix}'")
+        body = noid[len(self._prefix):]
+        if self._check_digit:
+            body, check_digit = body[:-1], body[-1:]
+        n = _decode(self._compiled[0], self._compiled[1], body)
+        if self._check_digit and calculate_check_digit(body) != check_digit:
+            raise InvalidNoidError(f"'{noid}' has an invalid check digit")
+        return n
+
+    def mint(self, n: int = -1, requester: str = None) -> str:
+        """Mint a noid for 'n' or, if 'n' is negative, for a random index in the namespace
+
+        :param int n: a number to convert to a noid; default is -1 meaning create from random number
+        :param str requester: the requester recorded in the journal (default: the minter's requester)
+        :return str: the noid
+        :raises NamespaceExhaustedError: if a bitmap is used and every index has been minted
+        :raises DuplicateNoidError: if a bitmap is used and 'n' has already been minted
+        """
+        if n < 0:
+            if self.bitmap is not None:
+                n = self.bitmap.claim_random(self._random())
+            else:
+                n = self._random().randrange(self.size)
+        elif self.bitmap is not None:
+            noid = self.noid(n)
+            if not self.bitmap.mark(n):
+                raise DuplicateNoidError(f"a noid for (counter = {n}) has already been minted")
+            return self._issue(noid, requester)
+        return self._issue(self.noid(n), requester)
+
+    def next(self, requester: str = None) -> str:
+        """Mint the next sequential noid
+
+        :param str requester: the requester recorded in the journal (default: the minter's requester)
+        :return str: the noid
+        :raises NamespaceOverflowError: if all indices in the namespace have been handed out
+        """
+        if self.bitmap is not None:
+            return self._issue(self.noid(self.bitmap.claim()), requester)
+        return self._issue(self.noid(self._next_index()), requester)
 
 
 def validate(noid: str) -> bool:
@@ -147,11 +488,62 @@ def calculate_check_digit(noid: str) -> str:
     return utils.XDIGIT[index]
 
 
+def _mint_command(args) -> int:
+    """Mint a noid for the parsed command line arguments, using a bitmap and journal if given
+
+    :param args: the parsed arguments (see :py:data:`noid.cli.parser`)
+    :return int: the exit code
+    """
+    if args.verbose:
+        print(f"info: generating noid using template={args.template}, n={args.index}, "
+              f"scheme={args.scheme}, naa={args.naa}...", file=sys.stderr)
+    try:
+        with contextlib.ExitStack() as stack:
+            journal = bitmap = None
+            requester = args.requester
+            if args.bitmap:
+                if args.verbose:
+                    print(f"info: drawing from the free indices in bitmap '{args.bitmap}'...", file=sys.stderr)
+                bitmap = stack.enter_context(_open_bitmap(args.bitmap, args.template))
+            if args.journal:
+                requester = requester or getpass.getuser()
+                if args.verbose:
+                    print(f"info: recording noid in journal '{args.journal}' for requester={requester}...",
+                          file=sys.stderr)
+                journal = stack.enter_context(Journal(args.journal, repair=args.repair_journal))
+            noid = mint(args.template, args.index, scheme=args.scheme, naa=args.naa, journal=journal,
+                        requester=requester, bitmap=bitmap)
+    except (JournalError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return IOERR_EXIT_CODE
+    except NoidError as e:
+        # e.g. a bitmap for a different template
+        print(f"error: {e}", file=sys.stderr)
+        return USAGE_EXIT_CODE
+    if args.bitmap and not noid:
+        # the namespace is full or the index is taken (the error is printed); scripts must not see a blank noid
+        return DATAERR_EXIT_CODE
+    print(noid)
+    return SUCCESS_EXIT_CODE
+
+
 def main():
     """Main entry point"""
     args = cli.parse_args()
     if args is None:
         return USAGE_EXIT_CODE
+    if args.command == 'transcode':
+        # imported here because noid.transcode depends on this module
+        from noid import transcode
+        try:
+            failures = transcode.main(args)
+        except NoidError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return USAGE_EXIT_CODE
+        except OSError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return IOERR_EXIT_CODE
+        return DATAERR_EXIT_CODE if failures else SUCCESS_EXIT_CODE
     if args.validate:
         if args.verbose:
             print(f"info: validating '{args.noid}'...", file=sys.stderr)
@@ -162,11 +554,7 @@ def main():
         check_digit = calculate_check_digit(args.noid)
         print(check_digit)
     else:
-        if args.verbose:
-            print(f"info: generating noid using template={args.template}, n={args.index}, "
-                  f"scheme={args.scheme}, naa={args.naa}...", file=sys.stderr)
-        noid = mint(args.template, args.index, scheme=args.scheme, naa=args.naa)
-        print(noid)
+        return _mint_command(args)
     return SUCCESS_EXIT_CODE
 
 
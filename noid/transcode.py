@@ -0,0 +1,174 @@
+"""
+Bulk transcoding of noids between templates
+===========================================
+Each noid is decoded to the index it was minted from, then re-encoded (with a new check digit, scheme and naa) under
+the target template. Input is consumed in chunks so memory stays bounded however many noids are streamed; with more
+than one worker, chunks are transcoded in separate processes and at most two chunks per worker are in flight.
+Results are produced in input order.
+
+Example:
+with open('old.txt') as f:
+    for result in transcode(f, 'zeedk', 'zeeeeddk', from_scheme='ark:/', from_naa='12345'):
+        print(result.old, result.new or result.error)
+"""
+import collections
+import concurrent.futures
+import contextlib
+import itertools
+import sys
+
+from noid.exceptions import NoidError
+from noid.pynoid import Minter
+
+TranscodeResult = collections.namedtuple('TranscodeResult', ['old', 'new', 'index', 'error'])
+TranscodeResult.__doc__ = """The outcome of transcoding one noid; 'new' is None and 'error' says why on failure"""
+
+# the transcoder used by each worker process and the arguments it was created with
+_transcoder = None
+_transcoder_args = None
+
+
+class Transcoder:
+    """Transcode noids from one template (and scheme and naa) to another"""
+
+    def __init__(self, from_template: str, to_template: str, from_scheme: str = '', from_naa: str = '',
+                 to_scheme: str = None, to_naa: str = None):
+        """
+
+        :param str from_template: the template the noids were minted with
+        :param str to_template: the template to transcode to
+        :param str from_scheme: the scheme of the noids
+        :param str from_naa: the naa of the noids
+        :param str to_scheme: the scheme to transcode to (default: None, same as 'from_scheme')
+        :param str to_naa: the naa to transcode to (default: None, same as 'from_naa')
+        :raises InvalidTemplateError: if either template is invalid
+        """
+        self.source = Minter(from_template, scheme=from_scheme, naa=from_naa)
+        self.target = Minter(
+            to_template,
+            scheme=from_scheme if to_scheme is None else to_scheme,
+            naa=from_naa if to_naa is None else to_naa
+        )
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.source!r}, {self.target!r})"
+
+    def transcode(self, noid: str) -> TranscodeResult:
+        """Transcode a single noid
+
+        :param str noid: a noid minted with the source template
+        :return TranscodeResult: the result
+        """
+        index = None
+        try:
+            index = self.source.index(noid)
+            return TranscodeResult(noid, self.target.noid(index), index, None)
+        except NoidError as e:
+            return TranscodeResult(noid, None, index, str(e))
+
+    def transcode_chunk(self, noids: list) -> list:
+        """Transcode a list of noids
+
+        :param list noids: noids minted with the source template
+        :return list: a :py:class:`TranscodeResult` for each noid
+        """
+        return [self.transcode(noid) for noid in noids]
+
+
+def _transcode_chunk(args: tuple, noids: list) -> list:
+    """Transcode a chunk in a worker process, reusing the transcoder for the same arguments"""
+    global _transcoder, _transcoder_args
+    if args != _transcoder_args:
+        _transcoder = Transcoder(*args)
+        _transcoder_args = args
+    return _transcoder.transcode_chunk(noids)
+
+
+def _chunks(noids, chunk_size: int):
+    """Group stripped, non-blank noids into lists of at most 'chunk_size'"""
+    noids = (noid.strip() for noid in noids)
+    noids = (noid for noid in noids if noid)
+    while True:
+        chunk = list(itertools.islice(noids, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def transcode(noids, from_template: str, to_template: str, from_scheme: str = '', from_naa: str = '',
+              to_scheme: str = None, to_naa: str = None, chunk_size: int = 10000, workers: int = 1):
+    """Stream noids from one template to another
+
+    :param noids: an iterable of noids (e.g. an open file); surrounding whitespace and blank lines are ignored
+    :param str from_template: the template the noids were minted with
+    :param str to_template: the template to transcode to
+    :param str from_scheme: the scheme of the noids
+    :param str from_naa: the naa of the noids
+    :param str to_scheme: the scheme to transcode to (default: None, same as 'from_scheme')
+    :param str to_naa: the naa to transcode to (default: None, same as 'from_naa')
+    :param int chunk_size: the number of noids transcoded together
+    :param int workers: the number of processes to use (default: 1, transcode in this process)
+    :return: an iterator of :py:class:`TranscodeResult` objects in input order
+    :raises InvalidTemplateError: if either template is invalid
+    :raises ValueError: if 'chunk_size' or 'workers' is not positive
+    """
+    if chunk_size < 1 or workers < 1:
+        raise ValueError(f"chunk_size and workers must be positive: {chunk_size}, {workers}")
+    args = (from_template, to_template, from_scheme, from_naa, to_scheme, to_naa)
+    # not a generator itself so that invalid templates raise here rather than on the first result
+    transcoder = Transcoder(*args)
+    if workers <= 1:
+        return _transcode(transcoder, _chunks(noids, chunk_size))
+    return _transcode_parallel(args, _chunks(noids, chunk_size), workers)
+
+
+def _transcode(transcoder: Transcoder, chunks):
+    """Transcode chunks in this process"""
+    for chunk in chunks:
+        yield from transcoder.transcode_chunk(chunk)
+
+
+def _transcode_parallel(args: tuple, chunks, workers: int):
+    """Transcode chunks in worker processes, keeping at most two chunks per worker in flight"""
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_transcode_chunk, args, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main(args) -> int:
+    """Run 'noid transcode' for the parsed command line arguments
+
+    :param args: the parsed arguments (see :py:data:`noid.cli.transcode_parser`)
+    :return int: the number of noids that could not be transcoded
+    :raises NoidError: if either template is invalid; no file is opened
+    :raises OSError: if the input or output file cannot be opened
+    """
+    if args.verbose:
+        print(f"info: transcoding noids from template={args.from_template} to template={args.to_template} "
+              f"using {args.jobs} job(s)...", file=sys.stderr)
+    # check the templates before the output file is opened (and so truncated)
+    Transcoder(args.from_template, args.to_template)
+    failures = 0
+    with contextlib.ExitStack() as stack:
+        noids = sys.stdin if args.input == '-' else stack.enter_context(open(args.input))
+        output = sys.stdout if args.output == '-' else stack.enter_context(open(args.output, 'w'))
+        results = transcode(
+            noids, args.from_template, args.to_template,
+            from_scheme=args.from_scheme, from_naa=args.from_naa, to_scheme=args.to_scheme, to_naa=args.to_naa,
+            chunk_size=args.chunk_size, workers=args.jobs
+        )
+        for result in results:
+            if result.error is None:
+                print(f"{result.old}\t{result.new}", file=output)
+            else:
+                failures += 1
+                index = '' if result.index is None else f" (index = {result.index})"
+                print(f"error: cannot transcode '{result.old}'{index}: {result.error}", file=sys.stderr)
+    if args.verbose:
+        print(f"info: {failures} noid(s) could not be transcoded", file=sys.stderr)
+    return failures
@@ -27,16 +27,21 @@ noid -t/--template zeek
 noid -n/--index
 
 """
+import collections
 import io
+import multiprocessing
 import os
 import pathlib
 import random
 import re
+import shutil
 import sys
 import tempfile
+import threading
 import unittest
+from unittest import mock
 
-from noid import cli, pynoid, utils
+from noid import bitmap, cli, exceptions, journal, pynoid, transcode, utils
 
 BASE_DIR = pathlib.Path(__file__).parent.parent
 CONFIG_FILE = BASE_DIR / 'noid' / 'noid.cfg'
@@ -52,8 +57,42 @@ class PynoidCLI(unittest.TestCase):
         self.assertEqual(args.naa, cli.DEFAULT_NAA)
         self.assertEqual(args.template, cli.DEFAULT_TEMPLATE)
         self.assertEqual(-1, args.index)
+        self.assertIsNone(args.bitmap)
+        self.assertIsNone(args.journal)
+        self.assertEqual('', args.requester)
         self.assertFalse(args.verbose)
 
+    def test_journal(self):
+        """Journal options from the command line or config file"""
+        args = cli.cli(f"noid -J minted.journal -R alice")
+        self.assertEqual('minted.journal', args.journal)
+        self.assertEqual('alice', args.requester)
+        _configs = """[noid]\ntemplate = zeek\nscheme = doi:\nnaa = 1234\njournal = minted.journal\nrequester = bob\n"""
+        temp_configs = tempfile.NamedTemporaryFile()
+        with open(temp_configs.name, 'w') as f:
+            print(_configs, file=f)
+        args = cli.cli(f"noid -c {temp_configs.name}")
+        self.assertEqual('minted.journal', args.journal)
+        self.assertEqual('bob', args.requester)
+
+    def test_transcode(self):
+        """The transcode command has its own options"""
+        args = cli.cli(f"noid transcode --from zeedk --to zeeeedk")
+        self.assertEqual('transcode', args.command)
+        self.assertEqual('zeedk', args.from_template)
+        self.assertEqual('zeeeedk', args.to_template)
+        self.assertEqual(cli.DEFAULT_SCHEME, args.from_scheme)
+        self.assertEqual(cli.DEFAULT_NAA, args.from_naa)
+        self.assertIsNone(args.to_scheme)
+        self.assertIsNone(args.to_naa)
+        self.assertEqual(1, args.jobs)
+        self.assertEqual('-', args.input)
+        self.assertEqual('-', args.output)
+        self.assertIsNone(cli.cli(f"noid transcode --from zeedk --to zeeeedk -j 0"))
+        with self.assertRaises(SystemExit):
+            cli.cli(f"noid transcode --from zeedk")
+        self.assertIsNone(cli.cli(f"noid").command)
+
     def test_validate(self):
         """Validation requires noid positional argument"""
         self.assertIsNone(cli.cli(f"noid -V"))
@@ -221,6 +260,84 @@ class PynoidNoid(unittest.TestCase):
         self.assertRegex(sys.stdout.getvalue(),
                          r"(?ms:^info: generating noid.*template=zeeddk.*scheme=https[:][/][/].*naa=54321.*https[:][/][/]54321[/][\w\d]+)")
 
+    def test_journal(self):
+        """Minted noids are journaled"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'minted.journal')
+            cli.cli(f"noid -n 42 -J {path} -R alice")
+            sys.stdout = io.StringIO()
+            self.assertEqual(pynoid.SUCCESS_EXIT_CODE, pynoid.main())
+            records = list(journal.replay(path))
+            self.assertEqual([sys.stdout.getvalue().strip()], [record.noid for record in records])
+            self.assertEqual('alice', records[0].requester)
+
+    def test_bitmap(self):
+        """Minting from a bitmap never repeats a noid"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'zd.bitmap')
+            noids = list()
+            for _ in range(len(utils.DIGIT)):
+                cli.cli(f"noid -t zd -s '' -B {path}")
+                sys.stdout = io.StringIO()
+                self.assertEqual(pynoid.SUCCESS_EXIT_CODE, pynoid.main())
+                noids.append(sys.stdout.getvalue().strip())
+            self.assertEqual(utils.DIGIT, sorted(noids))
+            # a full namespace, a used index and an index outside the namespace print an error and no noid
+            cli.cli(f"noid -t zd -B {path}")
+            sys.stdout = sys.stderr = io.StringIO()
+            self.assertEqual(pynoid.DATAERR_EXIT_CODE, pynoid.main())
+            self.assertRegex(sys.stderr.getvalue(), r"(?ms:^error: namespace .* is full [^\n]*\n\Z)")
+            cli.cli(f"noid -t zd -n 3 -B {path}")
+            sys.stdout = sys.stderr = io.StringIO()
+            self.assertEqual(pynoid.DATAERR_EXIT_CODE, pynoid.main())
+            self.assertRegex(sys.stderr.getvalue(), r"(?ms:^error: a noid for [(]counter = 3[)] has already been minted)")
+            cli.cli(f"noid -t zd -n 10 -B {path}")
+            sys.stdout = sys.stderr = io.StringIO()
+            self.assertEqual(pynoid.DATAERR_EXIT_CODE, pynoid.main())
+            self.assertRegex(sys.stderr.getvalue(), r"(?ms:^error: index 10 is outside the namespace)")
+            # a bitmap for a different template is refused
+            cli.cli(f"noid -t zdd -B {path}")
+            sys.stdout = sys.stderr = io.StringIO()
+            self.assertEqual(pynoid.USAGE_EXIT_CODE, pynoid.main())
+            self.assertRegex(sys.stderr.getvalue(), r"(?ms:^error: bitmap .* tracks 10 indices, not 100)")
+            # an invalid template does not create a bitmap
+            other = os.path.join(tmpdir, 'other.bitmap')
+            cli.cli(f"noid -t abc -B {other}")
+            sys.stdout = sys.stderr = io.StringIO()
+            self.assertEqual(pynoid.USAGE_EXIT_CODE, pynoid.main())
+            self.assertRegex(sys.stderr.getvalue(), r"(?ms:^error: invalid template 'abc')")
+            self.assertFalse(os.path.exists(other))
+
+    def test_transcode(self):
+        """Transcode noids from a file"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_file = os.path.join(tmpdir, 'old.txt')
+            output_file = os.path.join(tmpdir, 'new.txt')
+            with open(input_file, 'w') as f:
+                for n in [0, 99, 999]:
+                    print(pynoid.mint('zedk', n, scheme='ark:/', naa='1234'), file=f)
+            cli.cli(f"noid transcode --from zedk --to zeedk --from-naa 1234 -i {input_file} -o {output_file}")
+            self.assertEqual(pynoid.SUCCESS_EXIT_CODE, pynoid.main())
+            with open(output_file) as f:
+                pairs = [line.rstrip('\n').split('\t') for line in f]
+            self.assertEqual([pynoid.mint('zeedk', n, scheme='ark:/', naa='1234') for n in [0, 99, 999]],
+                             [new for _, new in pairs])
+            # 999 does not fit in 'edk'
+            cli.cli(f"noid transcode --from zedk --to edk --from-naa 1234 -i {input_file} -o {output_file}")
+            sys.stderr = io.StringIO()
+            self.assertEqual(pynoid.DATAERR_EXIT_CODE, pynoid.main())
+            self.assertRegex(sys.stderr.getvalue(), r"(?ms:^error: cannot transcode .* [(]index = 999[)])")
+            # an invalid template or a missing input file leaves the output file untouched
+            with open(output_file) as f:
+                output = f.read()
+            cli.cli(f"noid transcode --from abc --to edk -i {input_file} -o {output_file}")
+            sys.stderr = io.StringIO()
+            self.assertEqual(pynoid.USAGE_EXIT_CODE, pynoid.main())
+            cli.cli(f"noid transcode --from zedk --to edk -i {input_file}.missing -o {output_file}")
+            self.assertEqual(pynoid.IOERR_EXIT_CODE, pynoid.main())
+            with open(output_file) as f:
+                self.assertEqual(output, f.read())
+
     def test_index(self):
         """Set index"""
         index = random.randint(1000, 2000)
@@ -265,6 +382,24 @@ class PynoidUtils(unittest.TestCase):
         self.assertFalse(utils.validate_mask('zeeedtdd'))
         self.assertFalse(utils.validate_mask('adddeeew'))
 
+    def test_decode_noid(self):
+        """Decoding inverts generation"""
+        for mask in ['zedk', 'eedde', 'zd', 'ze']:
+            for n in [0, 1, 57, 999, 123456]:
+                noid = pynoid.generate_noid(mask, n)
+                if noid:
+                    self.assertEqual(n, pynoid.decode_noid(mask, noid))
+        with self.assertRaises(exceptions.InvalidNoidError):
+            pynoid.decode_noid('ede', '1a')
+        with self.assertRaises(exceptions.InvalidNoidError):
+            pynoid.decode_noid('ede', '1a11')
+        with self.assertRaises(exceptions.InvalidNoidError):
+            pynoid.decode_noid('ede', '1a*')
+        with self.assertRaises(exceptions.InvalidNoidError):
+            pynoid.decode_noid('ede', 'aaa')
+        with self.assertRaises(exceptions.InvalidNoidError):
+            pynoid.decode_noid('zde', '01a')
+
     def test_get_noid_range(self):
         """Get the max_size"""
         xsize = len(utils.XDIGIT)
@@ -340,5 +475,392 @@ class PynoidTests(unittest.TestCase):
         self.assertFalse(pynoid.validate('K1w'))
 
 
+class PynoidMinter(unittest.TestCase):
+    def test_mint(self):
+        """A minter produces the same noids as the mint function"""
+        minter = pynoid.Minter('zeeddk', scheme='ark:/', naa='12345')
+        for n in [0, 1, 100, 99999, 123456789]:
+            self.assertEqual(pynoid.mint('zeeddk', n, scheme='ark:/', naa='12345'), minter.mint(n))
+        self.assertRegex(minter.mint(), r"^ark[:][/]12345[/][\w\d]{5}$")
+        self.assertTrue(pynoid.validate(pynoid.Minter('zeeddk', scheme='ark:/').mint()))
+        self.assertEqual('empiar.1Hs', pynoid.Minter('empiar.eek').mint(100))
+
+    def test_invalid_template(self):
+        """Invalid templates raise rather than return blank noids"""
+        with self.assertRaises(exceptions.InvalidTemplateError):
+            pynoid.Minter('abcdefg')
+        with self.assertRaises(exceptions.InvalidTemplateError):
+            pynoid.Minter('zk').mint(5)
+
+    def test_namespace_overflow(self):
+        """Overflow raises an exception"""
+        minter = pynoid.Minter('d')
+        with self.assertRaises(exceptions.NamespaceOverflowError):
+            minter.mint(len(utils.DIGIT) + 1)
+        with self.assertRaises(exceptions.NamespaceOverflowError):
+            minter.noid(-1)
+        # 'z' masks roll over instead
+        self.assertEqual('10', pynoid.Minter('zd').mint(len(utils.DIGIT)))
+
+    def test_seed(self):
+        """Seeded minters are reproducible"""
+        minter1 = pynoid.Minter('zeeeek', seed=42)
+        minter2 = pynoid.Minter('zeeeek', seed=42)
+        self.assertEqual([minter1.mint() for _ in range(10)], [minter2.mint() for _ in range(10)])
+
+    def test_index(self):
+        """A minter recovers the index of its noids"""
+        minter = pynoid.Minter('empiar.zeeddk', scheme='ark:/', naa='12345')
+        for n in [0, 5, 12345, 10 ** 9]:
+            self.assertEqual(n, minter.index(minter.noid(n)))
+        with self.assertRaises(exceptions.InvalidNoidError):
+            minter.index('doi:12345/empiar.000000')
+        noid = minter.noid(12345)
+        with self.assertRaises(exceptions.InvalidNoidError):
+            minter.index(noid[:-1] + ('0' if noid[-1] != '0' else '1'))
+
+    def test_next(self):
+        """Sequential minting exhausts the namespace"""
+        minter = pynoid.Minter('d', block_size=3)
+        self.assertEqual(utils.DIGIT, [minter.next() for _ in range(len(utils.DIGIT))])
+        with self.assertRaises(exceptions.NamespaceOverflowError):
+            minter.next()
+        minter = pynoid.Minter('zd', start=9)
+        self.assertEqual(['9', '10', '11'], [minter.next() for _ in range(3)])
+
+    def test_next_threads(self):
+        """Threads never receive the same sequential noid"""
+        minter = pynoid.Minter('zeek', block_size=16)
+        results = [list() for _ in range(8)]
+
+        def work(result):
+            for _ in range(500):
+                result.append(minter.next())
+
+        threads = [threading.Thread(target=work, args=(result,)) for result in results]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        noids = [noid for result in results for noid in result]
+        self.assertEqual(len(noids), len(set(noids)))
+
+
+class PynoidJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'minted.journal')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_record(self):
+        """Records are replayed in order with their requester"""
+        with journal.Journal(self.path) as _journal:
+            noids = [pynoid.mint('zeek', n, journal=_journal, requester='alice') for n in range(10)]
+        records = list(journal.replay(self.path))
+        self.assertEqual(noids, [record.noid for record in records])
+        self.assertTrue(all(record.requester == 'alice' for record in records))
+        self.assertEqual(journal.JournalReport(10, [], False), journal.verify(self.path))
+
+    def test_no_wait(self):
+        """Records need not be waited on individually"""
+        with journal.Journal(self.path, interval=0.01, batch_size=8) as _journal:
+            for n in range(100):
+                _journal.record(pynoid.mint('zeek', n), wait=False)
+            _journal.sync()
+            self.assertEqual(100, journal.verify(self.path).records)
+
+    def test_threads(self):
+        """Concurrent mints are all journaled"""
+        with pynoid.Minter('zeeek', journal=journal.Journal(self.path), requester='bob') as minter:
+            results = [list() for _ in range(4)]
+
+            def work(result):
+                for _ in range(50):
+                    result.append(minter.next())
+
+            threads = [threading.Thread(target=work, args=(result,)) for result in results]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        noids = [noid for result in results for noid in result]
+        self.assertEqual([], journal.unjournaled(self.path, noids))
+        self.assertEqual(['unknown'], journal.unjournaled(self.path, noids + ['unknown']))
+        with self.assertRaises(journal.JournalError):
+            minter.next()
+
+    def test_fsync_directory(self):
+        """The directory is synced when the journal is created"""
+        with mock.patch.object(journal, '_fsync_directory', wraps=journal._fsync_directory) as fsync_directory:
+            journal.Journal(self.path).close()
+            fsync_directory.assert_called_once_with(self.path)
+            journal.Journal(self.path).close()
+            fsync_directory.assert_called_once_with(self.path)
+
+    def test_recover(self):
+        """A torn final record is truncated; other corruption is an error"""
+        with journal.Journal(self.path) as _journal:
+            _journal.record('abc')
+            _journal.record('def')
+        with open(self.path, 'ab') as f:
+            f.write(b'0123')
+        self.assertTrue(journal.verify(self.path).torn)
+        with journal.Journal(self.path) as _journal:
+            self.assertTrue(_journal.report.torn)
+            _journal.record('ghi')
+        self.assertEqual(['abc', 'def', 'ghi'], [record.noid for record in journal.replay(self.path)])
+        # corrupt records after the last valid record are truncated too
+        with open(self.path, 'ab') as f:
+            f.write(b'\0' * 20 + b'\n' + b'garbled\n' + b'0123')
+        self.assertEqual(journal.JournalReport(3, [4, 5], True), journal.verify(self.path))
+        journal.Journal(self.path).close()
+        self.assertEqual(journal.JournalReport(3, [], False), journal.verify(self.path))
+        # 'g' is not a hex digit so the checksum of the first record is corrupt
+        with open(self.path, 'rb+') as f:
+            f.write(b'g')
+        self.assertEqual([1], journal.verify(self.path).corrupt)
+        with self.assertRaises(journal.JournalError):
+            journal.Journal(self.path)
+
+    def test_repair(self):
+        """Corrupt records followed by valid records are only dropped on request"""
+        with journal.Journal(self.path) as _journal:
+            _journal.record('abc')
+        # e.g. the first page of a batch was lost but the second was written
+        with open(self.path, 'ab') as f:
+            f.write(b'\0' * 20 + b'\n' + journal._encode('def', 0.0, 'alice'))
+        with self.assertRaises(journal.JournalError):
+            journal.Journal(self.path)
+        with journal.Journal(self.path, repair=True) as _journal:
+            self.assertEqual(journal.JournalReport(2, [2], False), _journal.report)
+            _journal.record('ghi')
+        self.assertEqual(['abc', 'def', 'ghi'], [record.noid for record in journal.replay(self.path)])
+        self.assertEqual(journal.JournalReport(3, [], False), journal.repair(self.path))
+        # from the command line
+        with open(self.path, 'ab') as f:
+            f.write(b'garbled\n' + journal._encode('jkl', 0.0, 'alice'))
+        cli.cli(f"noid -t zek -J {self.path}")
+        sys.stdout = sys.stderr = io.StringIO()
+        self.assertEqual(pynoid.IOERR_EXIT_CODE, pynoid.main())
+        cli.cli(f"noid -t zek -J {self.path} --repair-journal")
+        self.assertEqual(pynoid.SUCCESS_EXIT_CODE, pynoid.main())
+        self.assertEqual(5, journal.verify(self.path).records)
+
+    def test_from_config(self):
+        """Journaling is turned on by config"""
+        config_file = os.path.join(self.tmpdir.name, 'noid.cfg')
+        with open(config_file, 'w') as f:
+            print(f"[noid]\ntemplate = zeeek\nscheme = ark:/\nnaa = 1234\njournal = {self.path}\nrequester = carol",
+                  file=f)
+        with pynoid.Minter.from_config(config_file) as minter:
+            noid = minter.mint()
+            self.assertRegex(noid, r"^ark[:][/]1234[/][\w\d]{4}$")
+        self.assertEqual([journal.JournalRecord(noid, mock.ANY, 'carol')], list(journal.replay(self.path)))
+
+    def test_from_config_failure(self):
+        """The journal is closed if the minter cannot be created"""
+        config_file = os.path.join(self.tmpdir.name, 'noid.cfg')
+        with open(config_file, 'w') as f:
+            print(f"[noid]\ntemplate = abc\njournal = {self.path}", file=f)
+        with mock.patch.object(journal.Journal, 'close', autospec=True, side_effect=journal.Journal.close) as close:
+            with self.assertRaises(exceptions.InvalidTemplateError):
+                pynoid.Minter.from_config(config_file)
+            close.assert_called_once()
+
+
+def _claim_indices(path, count, queue):
+    """Claim indices from a bitmap in a separate process"""
+    with bitmap.NamespaceBitmap(path) as _bitmap:
+        queue.put([_bitmap.claim_random() for _ in range(count)])
+
+
+class PynoidBitmap(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'namespace.bitmap')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_mark(self):
+        """Marks persist between sessions"""
+        with bitmap.NamespaceBitmap(self.path, 1000) as _bitmap:
+            self.assertFalse(_bitmap.test(37))
+            self.assertTrue(_bitmap.mark(37))
+            self.assertFalse(_bitmap.mark(37))
+            self.assertIn(37, _bitmap)
+            with self.assertRaises(exceptions.NamespaceOverflowError):
+                _bitmap.mark(1000)
+        with bitmap.NamespaceBitmap(self.path) as _bitmap:
+            self.assertEqual(1000, _bitmap.size)
+            self.assertEqual(1, _bitmap.used)
+            self.assertIn(37, _bitmap)
+        with self.assertRaises(exceptions.NoidError):
+            bitmap.NamespaceBitmap(self.path, 999)
+
+    def test_count(self):
+        """Occupancy over the namespace or a range"""
+        with bitmap.NamespaceBitmap(self.path, 1000) as _bitmap:
+            indices = random.sample(range(1000), 300)
+            for index in indices:
+                _bitmap.mark(index)
+            self.assertEqual(300, _bitmap.count())
+            self.assertEqual(300, _bitmap.used)
+            self.assertEqual(700, _bitmap.free)
+            self.assertAlmostEqual(0.3, _bitmap.occupancy)
+            self.assertEqual(len([i for i in indices if 13 <= i < 517]), _bitmap.count(13, 517))
+
+    def test_next_free(self):
+        """Search a word at a time and wrap around"""
+        with bitmap.NamespaceBitmap(self.path, 1000) as _bitmap:
+            for index in range(3, 1000):
+                _bitmap.mark(index)
+            self.assertEqual(0, _bitmap.next_free())
+            self.assertEqual(1, _bitmap.next_free(1))
+            self.assertEqual(0, _bitmap.next_free(500))
+            self.assertEqual(-1, _bitmap.next_free(500, wrap=False))
+            self.assertEqual([0, 1, 2], sorted(_bitmap.claim(700) for _ in range(3)))
+            with self.assertRaises(exceptions.NamespaceExhaustedError):
+                _bitmap.claim()
+
+    def test_claim_full_chunks(self):
+        """Sequential claims skip chunks which are full instead of rescanning them"""
+        size = 2 * bitmap.CHUNK * 8 + 100
+        with bitmap.NamespaceBitmap(self.path, size) as _bitmap:
+            # fill the first chunk and then one more index
+            _bitmap._map[_bitmap._bits:_bitmap._bits + bitmap.CHUNK] = b'\xff' * bitmap.CHUNK
+            _bitmap.recount()
+            self.assertEqual(bitmap.CHUNK * 8, _bitmap.claim())
+            with mock.patch.object(_bitmap, '_scan_free', wraps=_bitmap._scan_free) as scan_free:
+                self.assertEqual([bitmap.CHUNK * 8 + 1, bitmap.CHUNK * 8 + 2], [_bitmap.claim() for _ in range(2)])
+                self.assertTrue(all(args[0] >= bitmap.CHUNK * 8 for args, _ in scan_free.call_args_list))
+            # a chunk is scanned again once its count shows a free index
+            _bitmap._map[_bitmap._bits] = 0xdf
+            _bitmap.recount()
+            self.assertEqual(5, _bitmap.claim())
+
+    def test_select_free(self):
+        """Free indices are selected by rank, across words, blocks and chunks"""
+        with bitmap.NamespaceBitmap(self.path, 3000) as _bitmap:
+            for index in random.sample(range(3000), 2000):
+                _bitmap.mark(index)
+            free = [index for index in range(3000) if index not in _bitmap]
+            self.assertEqual(free, [_bitmap.select_free(rank) for rank in range(_bitmap.free)])
+            self.assertEqual(-1, _bitmap.select_free(_bitmap.free))
+        size = 2 * bitmap.CHUNK * 8 + 100
+        with bitmap.NamespaceBitmap(os.path.join(self.tmpdir.name, 'large.bitmap'), size) as _bitmap:
+            for index in [0, 5, bitmap.CHUNK * 8 + 3, size - 1]:
+                _bitmap.mark(index)
+            self.assertEqual(4, _bitmap.recount())
+            self.assertEqual(6, _bitmap.select_free(4))
+            self.assertEqual(bitmap.CHUNK * 8 + 4, _bitmap.select_free(bitmap.CHUNK * 8 - 2 + 3))
+            self.assertEqual(size - 2, _bitmap.select_free(_bitmap.free - 1))
+
+    def test_claim_random(self):
+        """Random claims are uniform over the free indices however they are spread"""
+        free = [5, 6, 7, 3000]
+        with bitmap.NamespaceBitmap(self.path, 4096) as _bitmap:
+            for index in range(4096):
+                if index not in free:
+                    _bitmap.mark(index)
+        copy = os.path.join(self.tmpdir.name, 'copy.bitmap')
+        claims = collections.Counter()
+        for _ in range(400):
+            shutil.copyfile(self.path, copy)
+            with bitmap.NamespaceBitmap(copy) as _bitmap:
+                claims[_bitmap.claim_random()] += 1
+        self.assertEqual(set(free), set(claims))
+        # each has probability 1/4; 50 is more than 5 standard deviations from the expected 100
+        for index in free:
+            self.assertLess(abs(claims[index] - 100), 50)
+
+    @unittest.skipIf(bitmap.fcntl is None or 'fork' not in multiprocessing.get_all_start_methods(),
+                     "requires fcntl and fork")
+    def test_processes(self):
+        """Processes sharing a bitmap never claim the same index"""
+        bitmap.NamespaceBitmap(self.path, 10000).close()
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        processes = [context.Process(target=_claim_indices, args=(self.path, 2000, queue)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        indices = [index for _ in processes for index in queue.get()]
+        for process in processes:
+            process.join()
+        self.assertEqual(8000, len(set(indices)))
+        with bitmap.NamespaceBitmap(self.path) as _bitmap:
+            self.assertEqual(8000, _bitmap.used)
+            self.assertEqual(8000, _bitmap.recount())
+
+    def test_mint(self):
+        """Random minting fills the namespace without reissuing a noid"""
+        size = utils.get_noid_range('zek')
+        with pynoid.Minter('zek', bitmap=bitmap.NamespaceBitmap(self.path, size)) as minter:
+            noids = [minter.mint() for _ in range(size)]
+            self.assertEqual(size, len(set(noids)))
+            self.assertEqual(1.0, minter.bitmap.occupancy)
+            with self.assertRaises(exceptions.NamespaceExhaustedError):
+                minter.mint()
+            with self.assertRaises(exceptions.DuplicateNoidError):
+                minter.mint(5)
+        with bitmap.NamespaceBitmap(self.path) as _bitmap:
+            with self.assertRaises(exceptions.NoidError):
+                pynoid.Minter('zeek', bitmap=_bitmap)
+
+    def test_mint_function(self):
+        """The mint function draws from a bitmap"""
+        with bitmap.NamespaceBitmap(self.path, utils.get_noid_range('zd')) as _bitmap:
+            self.assertEqual('3', pynoid.mint('zd', 3, bitmap=_bitmap))
+            sys.stderr = io.StringIO()
+            self.assertEqual('', pynoid.mint('zd', 3, bitmap=_bitmap))
+            self.assertRegex(sys.stderr.getvalue(), r"error: a noid for [(]counter = 3[)] has already been minted")
+            noids = {pynoid.mint('zd', bitmap=_bitmap) for _ in range(len(utils.DIGIT) - 1)}
+            self.assertEqual(set(utils.DIGIT) - {'3'}, noids)
+            self.assertEqual('', pynoid.mint('zd', bitmap=_bitmap))
+            self.assertEqual('', pynoid.mint('zdd', bitmap=_bitmap))
+
+
+class PynoidTranscode(unittest.TestCase):
+    def test_transcode(self):
+        """Re-encode under a new template, scheme and naa"""
+        transcoder = transcode.Transcoder('zeedk', 'empiar.zeeeedk', from_scheme='ark:/', from_naa='1234',
+                                          to_scheme='doi:', to_naa='5678')
+        old = pynoid.mint('zeedk', 4321, scheme='ark:/', naa='1234')
+        new = pynoid.mint('empiar.zeeeedk', 4321, scheme='doi:', naa='5678')
+        self.assertEqual(transcode.TranscodeResult(old, new, 4321, None), transcoder.transcode(old))
+        self.assertTrue(pynoid.validate(transcoder.target.noid(4321)[len('doi:5678/empiar.'):]))
+
+    def test_errors(self):
+        """Failures are reported with the index where known"""
+        transcoder = transcode.Transcoder('zedk', 'edk')
+        result = transcoder.transcode(pynoid.mint('zedk', 1000))
+        self.assertIsNone(result.new)
+        self.assertEqual(1000, result.index)
+        self.assertRegex(result.error, r"counter = 1000")
+        result = transcoder.transcode('not a noid')
+        self.assertIsNone(result.new)
+        self.assertIsNone(result.index)
+        with self.assertRaises(exceptions.InvalidTemplateError):
+            transcode.Transcoder('zedk', 'abc')
+        # raised when called, not when iterated
+        with self.assertRaises(exceptions.InvalidTemplateError):
+            transcode.transcode(['0'], 'abc', 'edk')
+        with self.assertRaises(exceptions.InvalidTemplateError):
+            transcode.transcode(['0'], 'zedk', 'abc', workers=2)
+        with self.assertRaises(ValueError):
+            transcode.transcode(['0'], 'zedk', 'edk', chunk_size=0)
+
+    def test_stream(self):
+        """Results are in input order in chunks and across processes"""
+        indices = list(range(0, 5000, 7))
+        old = [pynoid.mint('zek', n) + '\n' for n in indices] + ['\n']
+        for workers in [1, 2]:
+            results = list(transcode.transcode(iter(old), 'zek', 'eeeek', chunk_size=50, workers=workers))
+            self.assertEqual([pynoid.mint('eeeek', n) for n in indices], [result.new for result in results])
+            self.assertEqual(indices, [result.index for result in results])
+
+
 if __name__ == '__main__':
     unittest.main()